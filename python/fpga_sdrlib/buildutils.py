@@ -2,6 +2,7 @@ import shutil
 import os
 import logging
 import filecmp
+import hashlib
 
 from fpga_sdrlib import config
 from fpga_sdrlib import message, uhd, flow, flter, fpgamath, fft
@@ -61,7 +62,31 @@ def d2pd(package, dependency):
 def pd2fn(pck, fn):
     return os.path.join(config.verilogdir, pck, fn)
     
+def _freeze_args(defines, extraargs):
+    # defines and extraargs are flat dicts of scalars so sorted items
+    # make a usable cache key.
+    return (tuple(sorted(defines.items())), tuple(sorted(extraargs.items())))
+
+def _sources_hash(filenames, definestr):
+    h = hashlib.blake2b(definestr.encode('utf-8'))
+    for fn in filenames:
+        f = open(fn, 'rb')
+        h.update(f.read())
+        f.close()
+    return h.hexdigest()[:16]
+
+# Memoizes generated executables and images within a process so that
+# test suites sharing a module only pay for elaboration once.
+_build_cache = {}
+
 def generate_B100_image(package, name, suffix, defines=config.default_defines, extraargs={}):
+    key = ('B100', package, name, suffix) + _freeze_args(defines, extraargs)
+    if key not in _build_cache:
+        _build_cache[key] = _generate_B100_image(
+            package, name, suffix, defines, extraargs)
+    return _build_cache[key]
+
+def _generate_B100_image(package, name, suffix, defines, extraargs):
     builddir = os.path.join(config.builddir, package)
     outputdir = os.path.join(builddir, 'build-B100_{name}{suffix}'.format(
             name=name, suffix=suffix))
@@ -101,6 +126,13 @@ def generate_B100_image(package, name, suffix, defines=config.default_defines, e
         return image_fn
 
 def generate_icarus_executable(package, name, suffix, defines=config.default_defines, extraargs={}):
+    key = ('icarus', package, name, suffix) + _freeze_args(defines, extraargs)
+    if key not in _build_cache:
+        _build_cache[key] = _generate_icarus_executable(
+            package, name, suffix, defines, extraargs)
+    return _build_cache[key]
+
+def _generate_icarus_executable(package, name, suffix, defines, extraargs):
     builddir = os.path.join(config.builddir, package)
     if name in compatibles[package]:
         dependencies = compatibles[package][name]
@@ -119,12 +151,25 @@ def generate_icarus_executable(package, name, suffix, defines=config.default_def
     executable = name + suffix
     executable = os.path.join(builddir, executable)
     definestr = make_define_string(defines)
+    # Skip iverilog if an executable built from identical sources and
+    # defines is already cached on disk.
+    cachedir = os.path.join(config.builddir, 'cache')
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+    cached_fn = os.path.join(cachedir, '{0}{1}-{2}'.format(
+            name, suffix, _sources_hash(inputfiles, definestr)))
+    if os.path.exists(cached_fn):
+        logger.debug("Using cached executable for %s", executable)
+        shutil.copyfile(cached_fn, executable)
+        return executable
     cmd = ("iverilog -o {executable} {definestr} {inputfiles}"
            ).format(executable=executable,
                     definestr=definestr,
                     inputfiles=inputfilestr)
     logger.debug(cmd)
     os.system(cmd)
+    if os.path.exists(executable):
+        shutil.copyfile(executable, cached_fn)
     return executable
 
 packages = {'message': message,
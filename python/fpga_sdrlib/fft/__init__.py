@@ -37,7 +37,7 @@ def make_twiddlefactors(pck, fn, dependencies, extraargs={}):
         raise ValueError("N for twiddlefactors.v is not known.")
     if width is None:
         raise ValueError("width for twidlefactors.v is not known.")
-    vs = [cmath.exp(-i*2j*cmath.pi/fft_length) for i in range(0, fft_length/2)]
+    vs = [cmath.exp(-i*2j*cmath.pi/fft_length) for i in range(0, fft_length//2)]
     tfs = cs_to_dicts(vs, width, clean1=False)
     tf_dict = {
         'N': fft_length,
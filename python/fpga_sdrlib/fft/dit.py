@@ -6,14 +6,14 @@ import cmath
 
 def pystage(N, start_index, in_data):
     assert(len(in_data) == N)
-    tfs = [cmath.exp(-i*2j*cmath.pi/N) for i in range(0, N/2)]
+    tfs = [cmath.exp(-i*2j*cmath.pi/N) for i in range(0, N//2)]
     tfs = tfs
     out_data = [None]*N
     # S is number of interleaved transforms.
-    S = N/2/pow(2,start_index)
-    for out_addr0 in range(N/2):
+    S = N//2//pow(2,start_index)
+    for out_addr0 in range(N//2):
         # out_addr0 = kS + j
-        out_addr1 = out_addr0 + N/2
+        out_addr1 = out_addr0 + N//2
         k = out_addr0 // S
         j = out_addr0 % S
         in_addr0 = 2*k*S + j
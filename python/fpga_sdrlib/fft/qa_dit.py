@@ -6,10 +6,10 @@ MyHDL Test Bench to check the vericode FFT.
 """
 
 import os
-import random
 import unittest
 import logging
 
+import numpy as np
 from numpy import fft
 
 from fpga_sdrlib.conversions import c_to_int, cs_to_int, int_to_c, int_to_cs
@@ -46,9 +46,7 @@ class DITTestBenchIcarus(TestBenchIcarus):
 class TestFFT(unittest.TestCase):
 
     def setUp(self):
-        rg = random.Random(0)
-        self.myrand = rg.random
-        self.myrandint = rg.randint
+        self.rng = np.random.default_rng(0)
 
     def test_sixteen(self):
         width = 16
@@ -74,7 +72,7 @@ class TestFFT(unittest.TestCase):
         N_data_sets = 4
         sendnth = 1
         # Check that this raises an overflow error
-        self.assertRaises(StandardError, self.random_template, (nlog2, width, N_data_sets, sendnth))
+        self.assertRaises(Exception, self.random_template, (nlog2, width, N_data_sets, sendnth))
 
     def random_template(self, nlog2, width, N_data_sets, sendnth):
         """
@@ -87,11 +85,11 @@ class TestFFT(unittest.TestCase):
         data_sets = []
         data = []
         for i in range(0, N_data_sets):
-            nd = [self.myrand()*2-1 + self.myrand()*2j-1jfor x in range(N)]
+            nd = (self.rng.random(N)*2-1 + 1j*(self.rng.random(N)*2-1)).tolist()
             data_sets.append(nd)
             data += nd
         mwidth = 3
-        ms = [self.myrandint(0, pow(2, mwidth)-1) for d in data]
+        ms = self.rng.integers(0, pow(2, mwidth), size=len(data)).tolist()
         # Create, setup and simulate the test bench.
         defines = config.updated_defines({"DEBUG": False,
                                           "WIDTH": width,